@@ -2,30 +2,275 @@
 Comprehensive audit logging for S3 Presigned URL API
 """
 
+import atexit
 import logging
-import json
-from datetime import datetime
-from typing import Dict, Any, Optional
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 from fastapi import Request
+import json
+import orjson
 import os
 
+try:
+    import msgpack
+except ImportError:  # Only needed for AUDIT_LOG_FORMAT=msgpack
+    msgpack = None
+
+# Audit writer configuration
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", "logs/audit.log")  # "" or /dev/stderr for stderr
+AUDIT_LOG_FORMAT = os.getenv("AUDIT_LOG_FORMAT", "json").lower()  # json, line or msgpack
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "100"))  # records per write
+AUDIT_BATCH_MS = int(os.getenv("AUDIT_BATCH_MS", "50"))  # max wait to fill a batch
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", str(64 * 1024)))
+AUDIT_FLUSH_MS = int(os.getenv("AUDIT_FLUSH_MS", "100"))  # max time a line stays buffered
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBatchWriter(threading.Thread):
+    """Background thread that drains queued audit entries and writes them in batches"""
+
+    def __init__(self, path: str, batch_size: int, batch_ms: int, flush_ms: int):
+        super().__init__(name="audit-writer", daemon=True)
+        self.queue: queue.Queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_ms / 1000
+        self.flush_interval = flush_ms / 1000
+        # Updated by request threads (overflow) and this thread (write errors)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+        # Buffered stream; flushed on an interval rather than per record
+        if path in ("", "/dev/stderr"):
+            self.stream = open(
+                sys.stderr.fileno(), "ab", buffering=AUDIT_BUFFER_SIZE, closefd=False
+            )
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.stream = open(path, "ab", buffering=AUDIT_BUFFER_SIZE)
+        self.last_flush = time.monotonic()
+        self.pending = False
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self._flush_wait())
+            except queue.Empty:
+                self._flush()
+                continue
+            if item is _STOP:
+                break
+
+            # Collect up to batch_size lines or until batch_timeout elapses
+            batch: List[bytes] = [item]
+            deadline = time.monotonic() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+        self._flush()
+
+    def _flush_wait(self) -> Optional[float]:
+        """Seconds until the next due flush, or None when nothing is buffered"""
+        if not self.pending:
+            return None
+        return max(0.0, self.last_flush + self.flush_interval - time.monotonic())
+
+    def _write(self, batch: List[bytes]):
+        # Encoded entries carry their own framing
+        try:
+            self.stream.write(b"".join(batch))
+        except OSError as e:
+            # Keep the writer alive through transient errors (disk full, EIO)
+            self.count_dropped(len(batch))
+            logger.error("Audit log write failed, dropped %d entries: %s", len(batch), e)
+            return
+        self.pending = True
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            try:
+                self.stream.flush()
+            except OSError as e:
+                # Unflushed bytes stay buffered and are retried on the next write
+                logger.error("Audit log flush failed: %s", e)
+            self.pending = False
+        self.last_flush = time.monotonic()
+
+    def count_dropped(self, count: int):
+        """Record entries that were discarded instead of written"""
+        with self.dropped_lock:
+            self.dropped += count
+
+    def close(self):
+        """Flush pending records and stop the writer thread"""
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join(timeout=5)
+        self.stream.close()
+
+
+class AuditQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for pre-encoded entries that never blocks the caller"""
+
+    def __init__(self, writer: AuditBatchWriter):
+        super().__init__(writer.queue)
+        self.writer = writer
+
+    def prepare(self, record: logging.LogRecord) -> bytes:
+        # Entries are already encoded by log_event, so skip the Formatter
+        return record.msg
+
+    def enqueue(self, payload: bytes):
+        # On overflow evict the oldest entry so the newest events are kept
+        while True:
+            try:
+                self.queue.put_nowait(payload)
+                return
+            except queue.Full:
+                pass
+            try:
+                oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            if oldest is _STOP:
+                # Writer is shutting down; keep the sentinel and drop this entry
+                self.queue.put(oldest)
+                self.writer.count_dropped(1)
+                return
+            self.writer.count_dropped(1)
+
+
+def _logfmt_value(value: Any) -> str:
+    if isinstance(value, datetime):
+        # Same UTC "Z" suffix as the JSON encoding
+        return value.isoformat().replace("+00:00", "Z")
+    text = str(value)
+    if not text or not text.isprintable() or any(c in text for c in ' "=\\'):
+        # Client-supplied values must not be able to start a new line; ASCII
+        # escaping also covers Unicode line breaks such as U+2028 and U+0085
+        return json.dumps(text)
+    return text
+
+
+def _encode_line(entry: Dict[str, Any]) -> bytes:
+    """Encode an audit entry as a logfmt-style key=value line"""
+    fields = [
+        f"{key}={_logfmt_value(value)}"
+        for key, value in entry.items()
+        if key != "details"
+    ]
+    fields.extend(
+        f"{key}={_logfmt_value(value)}" for key, value in entry["details"].items()
+    )
+    return (" ".join(fields) + "\n").encode()
+
+
+def _encode_json(entry: Dict[str, Any]) -> bytes:
+    """Encode an audit entry as a JSON line"""
+    return orjson.dumps(entry, option=orjson.OPT_UTC_Z | orjson.OPT_APPEND_NEWLINE)
+
+
+def _encode_msgpack(entry: Dict[str, Any]) -> bytes:
+    """Encode an audit entry as a self-delimiting MessagePack object"""
+    return msgpack.packb(entry, datetime=True)
+
+
+# Select the audit entry encoder once at import time
+if AUDIT_LOG_FORMAT == "json":
+    _encode = _encode_json
+elif AUDIT_LOG_FORMAT == "line":
+    _encode = _encode_line
+elif AUDIT_LOG_FORMAT == "msgpack":
+    if msgpack is None:
+        raise ImportError("The msgpack package is required for AUDIT_LOG_FORMAT=msgpack")
+    _encode = _encode_msgpack
+else:
+    raise ValueError(f"Unsupported AUDIT_LOG_FORMAT: {AUDIT_LOG_FORMAT}")
+
+
 # Configure audit logger
 audit_logger = logging.getLogger("audit")
 audit_logger.setLevel(logging.INFO)
+# Entries are encoded bytes meant only for the audit sink
+audit_logger.propagate = False
+
+# Audit writer and handler are created on first use, so importing this module
+# opens no files and starts no threads
+_HANDLER: Optional[AuditQueueHandler] = None
+_HANDLER_LOCK = threading.Lock()
+
+
+def _ensure_handler() -> AuditQueueHandler:
+    """Create the audit writer thread and attach its handler once"""
+    global _HANDLER
+    if _HANDLER is None:
+        with _HANDLER_LOCK:
+            if _HANDLER is None:
+                try:
+                    writer = AuditBatchWriter(
+                        AUDIT_LOG_FILE, AUDIT_BATCH_SIZE, AUDIT_BATCH_MS, AUDIT_FLUSH_MS
+                    )
+                except OSError as e:
+                    # Keep auditing (and serving requests) rather than failing
+                    # every audited request on an unwritable sink
+                    logger.error(
+                        "Cannot open audit log %s, writing audit entries to stderr: %s",
+                        AUDIT_LOG_FILE, e
+                    )
+                    writer = AuditBatchWriter(
+                        "", AUDIT_BATCH_SIZE, AUDIT_BATCH_MS, AUDIT_FLUSH_MS
+                    )
+                writer.start()
+                atexit.register(writer.close)
+
+                handler = AuditQueueHandler(writer)
+                handler.setLevel(logging.INFO)
+                audit_logger.addHandler(handler)
+                _HANDLER = handler
+    return _HANDLER
+
 
-# Create audit log handler
-audit_handler = logging.FileHandler(
-    os.getenv("AUDIT_LOG_FILE", "logs/audit.log")
-)
-audit_handler.setLevel(logging.INFO)
+def _request_context(request: Request) -> Tuple[datetime, Dict[str, str]]:
+    """Timestamp and request fields shared by every audit event of a request"""
+    ctx = getattr(request.state, "audit_ctx", None)
+    if ctx is None:
+        ctx = (
+            datetime.now(timezone.utc),
+            {
+                "client_ip": request.client.host if request.client else "unknown",
+                "user_agent": request.headers.get("user-agent", "unknown"),
+                "method": request.method,
+                "url": str(request.url),
+            },
+        )
+        request.state.audit_ctx = ctx
+    return ctx
 
-# Create audit log formatter
-audit_formatter = logging.Formatter(
-    '%(asctime)s - AUDIT - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-audit_handler.setFormatter(audit_formatter)
-audit_logger.addHandler(audit_handler)
 
 class AuditLogger:
     """Centralized audit logging for security events"""
@@ -35,29 +280,39 @@ class AuditLogger:
         event_type: str,
         user_id: str,
         request: Request,
-        details: Dict[str, Any] = None,
+        details: Union[Dict[str, Any], Callable[[], Dict[str, Any]]] = None,
         success: bool = True,
         error_message: str = None
     ):
-        """Log security and operational events"""
+        """
+        Log security and operational events
+        
+        details may be a callable so callers only build it when auditing is enabled.
+        """
+        
+        if not audit_logger.isEnabledFor(logging.INFO):
+            return
+        
+        _ensure_handler()
         
+        if callable(details):
+            details = details()
+        
+        timestamp, request_fields = _request_context(request)
         audit_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": timestamp,
             "event_type": event_type,
             "user_id": user_id,
             "success": success,
-            "client_ip": request.client.host if request.client else "unknown",
-            "user_agent": request.headers.get("user-agent", "unknown"),
-            "method": request.method,
-            "url": str(request.url),
+            **request_fields,
             "details": details or {}
         }
         
         if error_message:
             audit_entry["error"] = error_message
         
-        # Log as JSON for easy parsing
-        audit_logger.info(json.dumps(audit_entry))
+        # Encode once in the configured AUDIT_LOG_FORMAT
+        audit_logger.info(_encode(audit_entry))
     
     @staticmethod
     def log_presigned_url_generation(
@@ -72,14 +327,16 @@ class AuditLogger:
     ):
         """Log presigned URL generation events"""
         
-        details = {
-            "operation": operation,
-            "file_key": file_key,
-            "expiration_seconds": expiration_seconds
-        }
-        
-        if filename:
-            details["filename"] = filename
+        def details():
+            details = {
+                "operation": operation,
+                "file_key": file_key,
+                "expiration_seconds": expiration_seconds
+            }
+            
+            if filename:
+                details["filename"] = filename
+            return details
         
         AuditLogger.log_event(
             event_type="presigned_url_generated",
@@ -115,10 +372,11 @@ class AuditLogger:
     ):
         """Log authorization failures"""
         
-        details = {
-            "required_permission": required_permission,
-            "endpoint": str(request.url.path)
-        }
+        def details():
+            return {
+                "required_permission": required_permission,
+                "endpoint": str(request.url.path)
+            }
         
         AuditLogger.log_event(
             event_type="authorization_failure",
@@ -137,10 +395,11 @@ class AuditLogger:
     ):
         """Log rate limit violations"""
         
-        details = {
-            "endpoint": endpoint,
-            "retry_after_seconds": retry_after
-        }
+        def details():
+            return {
+                "endpoint": endpoint,
+                "retry_after_seconds": retry_after
+            }
         
         AuditLogger.log_event(
             event_type="rate_limit_exceeded",
@@ -162,14 +421,16 @@ class AuditLogger:
     ):
         """Log file operations"""
         
-        details = {
-            "operation": operation
-        }
-        
-        if file_key:
-            details["file_key"] = file_key
-        if file_count is not None:
-            details["file_count"] = file_count
+        def details():
+            details = {
+                "operation": operation
+            }
+            
+            if file_key:
+                details["file_key"] = file_key
+            if file_count is not None:
+                details["file_count"] = file_count
+            return details
         
         AuditLogger.log_event(
             event_type="file_operation",
@@ -178,7 +439,4 @@ class AuditLogger:
             details=details,
             success=success,
             error_message=error_message
-        )
-
-# Create logs directory if it doesn't exist
-os.makedirs("logs", exist_ok=True)
\ No newline at end of file
+        )
\ No newline at end of file
@@ -5,9 +5,13 @@ Authentication and authorization module for S3 Presigned URL API
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from hashlib import blake2b
 import os
-from typing import Optional, Dict, Any
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,6 +21,17 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-producti
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
 
+# Token decoder with options and key material bound once at import
+_JWT_SECRET_BYTES = JWT_SECRET_KEY.encode()
+_JWT_ALGORITHMS = (JWT_ALGORITHM,)
+_jwt_decoder = jwt.PyJWT(options={"require": ["exp"], "verify_signature": True})
+
+# Verified token cache: token digest -> (cache_expiry, payload)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", "60"))  # seconds
+_token_cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
 security = HTTPBearer()
 
 class AuthService:
@@ -40,10 +55,27 @@ class AuthService:
     
     @staticmethod
     def verify_token(token: str) -> Dict[str, Any]:
-        """Verify and decode JWT token"""
+        """
+        Verify and decode JWT token, reusing recent verifications of the same token
+
+        Returns a shallow copy of the payload, so callers may modify it without
+        affecting the cache.
+        """
+        cache_key = blake2b(token.encode(), digest_size=16).digest()
+        now = time.time()
+        
+        with _token_cache_lock:
+            cached = _token_cache.get(cache_key)
+            if cached is not None:
+                if now < cached[0]:
+                    _token_cache.move_to_end(cache_key)
+                    return dict(cached[1])
+                del _token_cache[cache_key]
+        
         try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            return payload
+            payload = _jwt_decoder.decode(
+                token, _JWT_SECRET_BYTES, algorithms=_JWT_ALGORITHMS
+            )
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,15 +86,24 @@ class AuthService:
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token"
             )
+        
+        # Never serve a cached payload past the token's own expiry
+        expires_at = min(float(payload["exp"]), now + JWT_CACHE_TTL)
+        with _token_cache_lock:
+            _token_cache[cache_key] = (expires_at, payload)
+            if len(_token_cache) > JWT_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+        
+        return dict(payload)
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     """Dependency to get current authenticated user"""
     try:
         payload = AuthService.verify_token(credentials.credentials)
-        logger.info(f"User {payload.get('user_id')} authenticated successfully")
+        logger.info("User %s authenticated successfully", payload.get("user_id"))
         return payload
     except HTTPException as e:
-        logger.warning(f"Authentication failed: {e.detail}")
+        logger.warning("Authentication failed: %s", e.detail)
         raise e
 
 def require_permission(permission: str):
@@ -70,7 +111,9 @@ def require_permission(permission: str):
     def permission_checker(current_user: Dict[str, Any] = Depends(get_current_user)):
         user_permissions = current_user.get("permissions", [])
         if permission not in user_permissions:
-            logger.warning(f"User {current_user.get('user_id')} lacks permission: {permission}")
+            logger.warning(
+                "User %s lacks permission: %s", current_user.get("user_id"), permission
+            )
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Insufficient permissions. Required: {permission}"
@@ -1,4 +1,5 @@
 import os
+from types import MappingProxyType
 from typing import List
 
 from dotenv import load_dotenv
@@ -12,6 +13,10 @@ class Settings:
     AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY") or ""
     AWS_REGION: str = os.getenv("AWS_REGION", "us-east-1")
     S3_BUCKET_NAME: str = os.getenv("S3_BUCKET_NAME") or ""
+    S3_MAX_POOL_CONNECTIONS: int = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "64"))
+
+    # Seconds to reuse the S3 health check result
+    HEALTH_CHECK_TTL: float = float(os.getenv("HEALTH_CHECK_TTL", "5"))
 
     # Presigned URL settings
     PRESIGNED_URL_EXPIRATION: int = int(
@@ -30,6 +35,9 @@ class Settings:
     RATE_LIMIT_DOWNLOAD: int = int(os.getenv("RATE_LIMIT_DOWNLOAD", "30"))  # per minute
     RATE_LIMIT_LIST: int = int(os.getenv("RATE_LIMIT_LIST", "5"))  # per minute
     RATE_LIMIT_DELETE: int = int(os.getenv("RATE_LIMIT_DELETE", "5"))  # per minute
+    REDIS_URL: str = os.getenv("REDIS_URL", "")  # Shared rate limits across workers
+    REDIS_TIMEOUT: float = float(os.getenv("REDIS_TIMEOUT", "0.25"))  # seconds
+    REDIS_RETRY_SECONDS: float = float(os.getenv("REDIS_RETRY_SECONDS", "5"))
     
     # Logging settings
     AUDIT_LOG_FILE: str = os.getenv("AUDIT_LOG_FILE", "logs/audit.log")
@@ -44,9 +52,11 @@ class Settings:
     # File validation settings
     ENFORCE_FILE_SIZE_ON_UPLOAD: bool = os.getenv("ENFORCE_FILE_SIZE_ON_UPLOAD", "true").lower() == "true"
     SCAN_FILES_FOR_MALWARE: bool = os.getenv("SCAN_FILES_FOR_MALWARE", "false").lower() == "true"
+    # Check objects exist before issuing download URLs (one extra S3 request)
+    STRICT_EXISTS_CHECK: bool = os.getenv("STRICT_EXISTS_CHECK", "false").lower() == "true"
 
-    # Allowed file types and their MIME types
-    ALLOWED_FILE_TYPES = {
+    # Allowed file types and their MIME types (lowercase keys, read-only)
+    ALLOWED_FILE_TYPES = MappingProxyType({
         ".jpg": "image/jpeg",
         ".jpeg": "image/jpeg",
         ".png": "image/png",
@@ -60,13 +70,13 @@ class Settings:
         ".mp4": "video/mp4",
         ".mp3": "audio/mpeg",
         ".zip": "application/zip",
-    }
+    })
     
-    # Blocked file types (security)
-    BLOCKED_FILE_TYPES = {
+    # Blocked file types (security, lowercase, read-only)
+    BLOCKED_FILE_TYPES = frozenset({
         ".exe", ".bat", ".cmd", ".com", ".pif", ".scr", ".vbs", ".js", 
         ".jar", ".sh", ".ps1", ".php", ".asp", ".aspx", ".jsp"
-    }
+    })
 
     def is_production(self) -> bool:
         return self.ENVIRONMENT.lower() == "production"
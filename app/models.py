@@ -47,7 +47,7 @@ class FileListResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     s3_connection: str
-    timestamp: datetime
+    timestamp: str = Field(..., description="UTC ISO 8601 time, cached for ~100ms")
 
 
 class ErrorResponse(BaseModel):
@@ -3,16 +3,23 @@ Rate limiting and throttling for S3 Presigned URL API
 """
 
 from fastapi import HTTPException, Request, status
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+import secrets
 import time
-import asyncio
-from collections import defaultdict, deque
 import logging
 
+from app.config import settings
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # Redis is only needed when REDIS_URL is configured
+    aioredis = None
+
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    """Token bucket rate limiter implementation"""
+    """Sliding window counter rate limiter implementation"""
     
     def __init__(self):
         # Rate limits per endpoint per user (requests per minute)
@@ -22,76 +29,189 @@ class RateLimiter:
             "list": 5,       # 5 list requests per minute
             "delete": 5      # 5 delete requests per minute
         }
+        self.window_seconds = 60
         
-        # Storage for rate limit tracking
-        self.user_requests: Dict[str, Dict[str, deque]] = defaultdict(lambda: defaultdict(deque))
-        self.cleanup_interval = 300  # Clean up old entries every 5 minutes
-        self.last_cleanup = time.time()
+        # (user_id, endpoint) -> (window_index, current_count, previous_count)
+        self.counters: Dict[Tuple[str, str], Tuple[int, int, int]] = {}
+        self.max_entries = 100_000  # Sweep stale counters beyond this size
+        self.last_sweep_window: Optional[int] = None  # Sweep at most once per window
     
-    def _cleanup_old_entries(self):
-        """Remove old request entries to prevent memory leaks"""
-        current_time = time.time()
-        if current_time - self.last_cleanup < self.cleanup_interval:
-            return
-            
-        cutoff_time = current_time - 60  # Keep only last minute
-        
-        for user_id in list(self.user_requests.keys()):
-            for endpoint in list(self.user_requests[user_id].keys()):
-                requests = self.user_requests[user_id][endpoint]
-                
-                # Remove old requests
-                while requests and requests[0] < cutoff_time:
-                    requests.popleft()
-                
-                # Clean up empty structures
-                if not requests:
-                    del self.user_requests[user_id][endpoint]
-            
-            if not self.user_requests[user_id]:
-                del self.user_requests[user_id]
-        
-        self.last_cleanup = current_time
+    def _sweep_stale_entries(self, window: int):
+        """Drop counters that can no longer affect a rate limit decision"""
+        self.counters = {
+            key: entry for key, entry in self.counters.items()
+            if entry[0] >= window - 1
+        }
+        self.last_sweep_window = window
     
-    def is_allowed(self, user_id: str, endpoint: str) -> tuple[bool, Optional[int]]:
+    def is_allowed(
+        self, user_id: str, endpoint: str, now: Optional[float] = None
+    ) -> tuple[bool, Optional[int]]:
         """
         Check if request is allowed under rate limits
         Returns (is_allowed, retry_after_seconds)
-        """
-        self._cleanup_old_entries()
         
-        current_time = time.time()
+        now is a time.monotonic() reading, normally taken once per request.
+        The request rate is estimated as the current window's count plus the
+        previous window's count weighted by how much of it still overlaps the
+        trailing minute.
+        """
+        window_seconds = self.window_seconds
+        if now is None:
+            now = time.monotonic()
+        window, offset = divmod(now, window_seconds)
+        window = int(window)
         limit = self.rate_limits.get(endpoint, 60)  # Default 60 per minute
+        key = (user_id, endpoint)
         
-        # Get user's requests for this endpoint
-        user_endpoint_requests = self.user_requests[user_id][endpoint]
-        
-        # Remove requests older than 1 minute
-        while user_endpoint_requests and user_endpoint_requests[0] < current_time - 60:
-            user_endpoint_requests.popleft()
+        entry = self.counters.get(key)
+        if entry is None:
+            if len(self.counters) >= self.max_entries and self.last_sweep_window != window:
+                self._sweep_stale_entries(window)
+            current = previous = 0
+        else:
+            start, current, previous = entry
+            if start != window:
+                previous = current if start == window - 1 else 0
+                current = 0
         
         # Check if under limit
-        if len(user_endpoint_requests) < limit:
-            user_endpoint_requests.append(current_time)
-            logger.debug(f"Rate limit check passed for user {user_id}, endpoint {endpoint}")
+        overlap = 1 - offset / window_seconds
+        if previous * overlap + current < limit:
+            self.counters[key] = (window, current + 1, previous)
+            logger.debug(
+                "Rate limit check passed for user %s, endpoint %s", user_id, endpoint
+            )
             return True, None
         
+        self.counters[key] = (window, current, previous)
+        
         # Calculate retry after time
-        oldest_request = user_endpoint_requests[0]
-        retry_after = int(60 - (current_time - oldest_request)) + 1
+        if current >= limit:
+            # Wait for the next window, then for this window's weight to decay
+            wait = window_seconds - offset + window_seconds * (current - limit) / current
+        else:
+            # Wait for the previous window's weight to decay below the headroom
+            wait = window_seconds * (previous - limit + current) / previous - offset
+        # Arranged so exact waits stay exact: at now + wait the estimate equals
+        # the limit, so the next whole second after it is the first admitted
+        retry_after = int(wait) + 1
         
-        logger.warning(f"Rate limit exceeded for user {user_id}, endpoint {endpoint}")
+        logger.warning("Rate limit exceeded for user %s, endpoint %s", user_id, endpoint)
         return False, retry_after
 
-# Global rate limiter instance
+class RedisRateLimiter:
+    """Sliding window log rate limiter shared by all workers through Redis"""
+    
+    # Trim requests older than the window, then admit and record this one if
+    # under the limit. Rejections return the milliseconds until the oldest
+    # request leaves the window, so every check is a single round-trip.
+    SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return tonumber(oldest[2]) + window - now
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+"""
+    
+    def __init__(self, url: str, fallback: RateLimiter):
+        if aioredis is None:
+            raise ImportError("The redis package is required when REDIS_URL is set")
+        
+        # Fail fast so an unreachable Redis degrades to the local limiter
+        # instead of stalling requests on the OS connect timeout
+        self.redis = aioredis.from_url(
+            url,
+            socket_connect_timeout=settings.REDIS_TIMEOUT,
+            socket_timeout=settings.REDIS_TIMEOUT,
+        )
+        # Runs via EVALSHA, reloading the script if Redis reports NOSCRIPT
+        self.script = self.redis.register_script(self.SCRIPT)
+        self.fallback = fallback
+        self.window_ms = fallback.window_seconds * 1000
+        # After an error, skip Redis until this monotonic time
+        self.retry_at = 0.0
+    
+    async def load(self):
+        """Preload the script so the first request doesn't pay for SCRIPT LOAD"""
+        try:
+            self.script.sha = await self.redis.script_load(self.SCRIPT)
+        except RedisError as e:
+            logger.warning("Could not preload rate limit script: %s", e)
+    
+    async def close(self):
+        """Close the Redis connection pool"""
+        await self.redis.aclose()
+    
+    async def is_allowed(self, user_id: str, endpoint: str) -> tuple[bool, Optional[int]]:
+        """
+        Check if request is allowed under rate limits
+        Returns (is_allowed, retry_after_seconds)
+        
+        Falls back to the in-process limiter if Redis is unavailable.
+        """
+        if time.monotonic() < self.retry_at:
+            return self.fallback.is_allowed(user_id, endpoint)
+        
+        limit = self.fallback.rate_limits.get(endpoint, 60)
+        
+        # Wall clock, as scores must be comparable across workers and hosts
+        now_ms = time.time_ns() // 1_000_000
+        member = f"{now_ms}-{secrets.token_hex(4)}"
+        
+        try:
+            retry_ms = await self.script(
+                keys=[f"rl:{user_id}:{endpoint}"],
+                args=[now_ms, self.window_ms, limit, member],
+            )
+        except RedisError as e:
+            logger.warning(
+                "Redis rate limiting unavailable, using local limiter for %ss: %s",
+                settings.REDIS_RETRY_SECONDS, e
+            )
+            self.retry_at = time.monotonic() + settings.REDIS_RETRY_SECONDS
+            return self.fallback.is_allowed(user_id, endpoint)
+        
+        if retry_ms <= 0:
+            return True, None
+        
+        # Round up: the request is admitted once retry_ms has elapsed
+        retry_after = -(-retry_ms // 1000)
+        return False, retry_after
+
+class RequestClockMiddleware:
+    """ASGI middleware that reads the monotonic clock once per request"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            # Exposed to handlers and dependencies as request.state.now
+            scope.setdefault("state", {})["now"] = time.monotonic()
+        await self.app(scope, receive, send)
+
+# Global rate limiter instances
 rate_limiter = RateLimiter()
+redis_rate_limiter = (
+    RedisRateLimiter(settings.REDIS_URL, rate_limiter) if settings.REDIS_URL else None
+)
 
 async def check_rate_limit(request: Request, user_id: str, endpoint: str):
     """Dependency to check rate limits"""
-    is_allowed, retry_after = rate_limiter.is_allowed(user_id, endpoint)
+    if redis_rate_limiter is not None:
+        is_allowed, retry_after = await redis_rate_limiter.is_allowed(user_id, endpoint)
+    else:
+        now = getattr(request.state, "now", None)
+        is_allowed, retry_after = rate_limiter.is_allowed(user_id, endpoint, now)
     
     if not is_allowed:
-        logger.warning(f"Rate limit exceeded for user {user_id} on {endpoint}")
+        logger.warning("Rate limit exceeded for user %s on %s", user_id, endpoint)
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Rate limit exceeded for {endpoint}. Try again in {retry_after} seconds.",
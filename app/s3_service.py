@@ -1,28 +1,249 @@
+import hashlib
+import hmac
+import logging
 import os
-import uuid
-from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError, NoCredentialsError
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Keep-alive connection pool sized for concurrent requests, adaptive retries
+# under throttling and short timeouts so a degraded endpoint fails fast
+_S3_CONFIG = Config(
+    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    connect_timeout=2,
+    read_timeout=5,
+    signature_version="s3v4",
+    s3={"addressing_style": "virtual"},
+)
+
+# Process-wide session and client: credential resolution, endpoint setup and
+# the HTTPS connection pool are shared by every S3Service instead of rebuilt
+# per instance. Empty keys fall through to the default credential chain.
+_SESSION = boto3.session.Session(
+    aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None,
+    region_name=settings.AWS_REGION,
+)
+_S3 = _SESSION.client("s3", config=_S3_CONFIG)
+
+
+# Bound once; hashlib's sha256 and hmac.digest dispatch to OpenSSL, which uses
+# SHA-NI / ARMv8 SHA2 instructions where the CPU has them
+_sha256 = hashlib.sha256
+_hmac_digest = hmac.digest
+
+
+@lru_cache(maxsize=8)
+def _signing_key(secret_key: str, date: str, region: str) -> bytes:
+    """Derive the SigV4 signing key, which only changes daily or on rotation"""
+    key = _hmac_digest(f"AWS4{secret_key}".encode(), date.encode(), "sha256")
+    for part in (region, "s3", "aws4_request"):
+        key = _hmac_digest(key, part.encode(), "sha256")
+    return key
+
+
+# Random hex digits for key generation, read from the OS in bulk and handed
+# out in slices; reset in forked children so workers never share a buffer
+_RANDOM_BUFFER_BYTES = 4096
+_random_hex = ""
+_random_offset = 0
+_random_lock = threading.Lock()
+
+
+def _reset_random_buffer():
+    global _random_hex, _random_offset
+    _random_hex, _random_offset = "", 0
+
+
+os.register_at_fork(after_in_child=_reset_random_buffer)
+
+
+def _time_ordered_id() -> str:
+    """
+    Return a 32-character hex ID: 48-bit millisecond timestamp + 80 random bits
+
+    IDs sort by creation time to the millisecond (order within one millisecond
+    is random), and the random part makes collisions negligible.
+    """
+    global _random_hex, _random_offset
+    with _random_lock:
+        start = _random_offset
+        if start + 20 > len(_random_hex):
+            _random_hex, start = os.urandom(_RANDOM_BUFFER_BYTES).hex(), 0
+        _random_offset = start + 20
+        random_part = _random_hex[start : start + 20]
+    return f"{time.time_ns() // 1_000_000:012x}{random_part}"
+
+
+def get_file_extension(filename: str) -> str:
+    """Return the file extension including the dot, or "" if there is none"""
+    dot = filename.rfind(".")
+    # Like os.path.splitext, ignore dots in directories and leading dots (".env")
+    if dot <= filename.rfind("/") + 1:
+        return ""
+    return filename[dot:]
+
+
+class _SigV4Presigner:
+    """Local AWS Signature Version 4 query-string presigner for S3 objects"""
+
+    def __init__(
+        self, credentials: Credentials, region: str, bucket: str, endpoint_url: str
+    ):
+        # May be refreshable (instance role, SSO, assumed role) credentials
+        self.credentials = credentials
+        self.region = region
+        self.scope_suffix = f"/{region}/s3/aws4_request"
+
+        # The client's resolved endpoint, so other partitions (amazonaws.com.cn),
+        # AWS_ENDPOINT_URL_S3 and S3-compatible services are signed for correctly
+        endpoint = urlsplit(endpoint_url)
+        self.scheme = endpoint.scheme
+        base_path = endpoint.path.rstrip("/")
+        if "." in bucket:
+            # Dotted bucket names break virtual-host TLS, so use path style
+            self.host = endpoint.netloc
+            self.path_prefix = f"{base_path}/{quote(bucket, safe='')}/"
+        else:
+            self.host = f"{bucket}.{endpoint.netloc}"
+            self.path_prefix = f"{base_path}/"
+
+    def presign(
+        self,
+        method: str,
+        key: str,
+        expires_in: int,
+        content_type: Optional[str] = None,
+        now: Optional[datetime] = None,
+    ) -> str:
+        """Build a presigned URL for method on key, optionally binding Content-Type"""
+        # Refreshes temporary credentials when they are close to expiry
+        frozen = self.credentials.get_frozen_credentials()
+        access_key, secret_key, token = frozen.access_key, frozen.secret_key, frozen.token
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        scope = f"{date}{self.scope_suffix}"
+
+        path = self.path_prefix + quote(key, safe="/~")
+        if content_type:
+            signed_headers = "content-type%3Bhost"
+            # SigV4 trims header values and collapses internal whitespace
+            canonical_headers = (
+                f"content-type:{' '.join(content_type.split())}\nhost:{self.host}\n"
+            )
+        else:
+            signed_headers = "host"
+            canonical_headers = f"host:{self.host}\n"
+
+        # Parameters are already in canonical (sorted) order
+        query = (
+            "X-Amz-Algorithm=AWS4-HMAC-SHA256"
+            f"&X-Amz-Credential={quote(f'{access_key}/{scope}', safe='~')}"
+            f"&X-Amz-Date={amz_date}"
+            f"&X-Amz-Expires={expires_in}"
+        )
+        if token:
+            query += f"&X-Amz-Security-Token={quote(token, safe='~')}"
+        query += f"&X-Amz-SignedHeaders={signed_headers}"
+        canonical_request = (
+            f"{method}\n{path}\n{query}\n{canonical_headers}\n"
+            f"{'content-type;host' if content_type else 'host'}\nUNSIGNED-PAYLOAD"
+        )
+        string_to_sign = (
+            f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n"
+            f"{_sha256(canonical_request.encode()).hexdigest()}"
+        )
+        # Per URL: one canonical-request hash and one HMAC
+        signature = _hmac_digest(
+            _signing_key(secret_key, date, self.region),
+            string_to_sign.encode(),
+            "sha256",
+        ).hex()
+
+        return f"{self.scheme}://{self.host}{path}?{query}&X-Amz-Signature={signature}"
+
 
 class S3Service:
     def __init__(self):
-        self.s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_REGION,
-        )
+        self.s3_client = _S3
         self.bucket_name = settings.S3_BUCKET_NAME
 
+        # Built once the session's credentials are resolved; a miss is cached
+        # too, as botocore walks the whole provider chain on every lookup
+        self.presigner: Optional[_SigV4Presigner] = None
+        self._credentials_resolved = False
+        self._credentials_lock = threading.Lock()
+        # (monotonic time, result) of the last head_bucket health check
+        self._last_check: Tuple[float, bool] = (0.0, False)
+
+    def load_credentials(self) -> bool:
+        """
+        Resolve AWS credentials once and build the local presigner
+
+        May call the network (instance metadata, STS, SSO), so run it at
+        startup or in a worker thread. Returns False if none were found.
+        """
+        if not self._credentials_resolved:
+            with self._credentials_lock:
+                if not self._credentials_resolved:
+                    credentials = _SESSION.get_credentials()
+                    if credentials is None:
+                        logger.error(
+                            "No AWS credentials found; presigned URLs cannot be generated"
+                        )
+                    else:
+                        self.presigner = _SigV4Presigner(
+                            credentials,
+                            settings.AWS_REGION,
+                            self.bucket_name,
+                            self.s3_client.meta.endpoint_url,
+                        )
+                    self._credentials_resolved = True
+        return self.presigner is not None
+
+    def presign_may_block(self) -> bool:
+        """True if the next presign may resolve or refresh credentials over the network"""
+        if not self._credentials_resolved:
+            return True
+        if self.presigner is None:
+            return False
+        refresh_needed = getattr(self.presigner.credentials, "refresh_needed", None)
+        return refresh_needed is not None and refresh_needed()
+
+    def _presign(
+        self, client_method: str, key: str, content_type: Optional[str] = None
+    ) -> str:
+        """Generate a presigned URL for a get_object or put_object request"""
+        if not self.load_credentials():
+            raise NoCredentialsError()
+
+        method = "PUT" if client_method == "put_object" else "GET"
+        return self.presigner.presign(
+            method, key, settings.PRESIGNED_URL_EXPIRATION, content_type
+        )
+
     def validate_file_type(self, filename: str) -> Tuple[bool, str]:
         """Validate if the file type is allowed"""
-        file_extension = os.path.splitext(filename.lower())[1]
+        # Lowercase only the extension rather than the whole filename
+        file_extension = get_file_extension(filename).lower()
+        content_type = settings.ALLOWED_FILE_TYPES.get(file_extension)
 
-        if file_extension not in settings.ALLOWED_FILE_TYPES:
+        if content_type is None:
             allowed_types = list(settings.ALLOWED_FILE_TYPES.keys())
             message = (
                 f"File type {file_extension} not allowed. "
@@ -30,13 +251,11 @@ class S3Service:
             )
             return (False, message)
 
-        return True, settings.ALLOWED_FILE_TYPES[file_extension]
+        return True, content_type
 
     def generate_unique_key(self, filename: str, prefix: str = "uploads") -> str:
         """Generate a unique S3 key for the file"""
-        file_extension = os.path.splitext(filename)[1]
-        unique_id = str(uuid.uuid4())
-        return f"{prefix}/{unique_id}{file_extension}"
+        return f"{prefix}/{_time_ordered_id()}{get_file_extension(filename)}"
 
     def generate_upload_url(
         self, filename: str, content_type: Optional[str] = None
@@ -55,15 +274,7 @@ class S3Service:
             file_key = self.generate_unique_key(filename)
 
             # Generate presigned URL for PUT operation
-            presigned_url = self.s3_client.generate_presigned_url(
-                "put_object",
-                Params={
-                    "Bucket": self.bucket_name,
-                    "Key": file_key,
-                    "ContentType": final_content_type,
-                },
-                ExpiresIn=settings.PRESIGNED_URL_EXPIRATION,
-            )
+            presigned_url = self._presign("put_object", file_key, final_content_type)
 
             return {
                 "presigned_url": presigned_url,
@@ -77,20 +288,18 @@ class S3Service:
     def generate_download_url(self, file_key: str) -> Dict[str, Any]:
         """Generate presigned URL for file download"""
         try:
-            # Check if file exists
-            try:
-                self.s3_client.head_object(Bucket=self.bucket_name, Key=file_key)
-            except ClientError as e:
-                if e.response["Error"]["Code"] == "404":
-                    raise FileNotFoundError("File not found in S3")
-                raise e
+            # Missing objects surface as a 404 from S3 on GET; probing up front
+            # costs an extra round-trip, so it is opt-in
+            if settings.STRICT_EXISTS_CHECK:
+                try:
+                    self.s3_client.head_object(Bucket=self.bucket_name, Key=file_key)
+                except ClientError as e:
+                    if e.response["Error"]["Code"] == "404":
+                        raise FileNotFoundError("File not found in S3")
+                    raise e
 
             # Generate presigned URL for GET operation
-            presigned_url = self.s3_client.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": self.bucket_name, "Key": file_key},
-                ExpiresIn=settings.PRESIGNED_URL_EXPIRATION,
-            )
+            presigned_url = self._presign("get_object", file_key)
 
             return {
                 "presigned_url": presigned_url,
@@ -110,30 +319,44 @@ class S3Service:
                 Bucket=self.bucket_name, Prefix=prefix, MaxKeys=max_keys
             )
 
-            files = []
-            if "Contents" in response:
-                for obj in response["Contents"]:
-                    files.append(
-                        {
-                            "key": obj["Key"],
-                            "size": obj["Size"],
-                            "last_modified": obj["LastModified"],
-                            "etag": obj["ETag"].strip('"'),
-                        }
-                    )
+            files = [
+                {
+                    "key": obj["Key"],
+                    "size": obj["Size"],
+                    "last_modified": obj["LastModified"],
+                    "etag": obj["ETag"].strip('"'),
+                }
+                for obj in response.get("Contents", ())
+            ]
 
             return {"files": files, "count": len(files)}
 
         except ClientError as e:
             raise Exception(f"AWS S3 error: {str(e)}")
 
-    def check_connection(self) -> bool:
-        """Check S3 connection health"""
+    def check_connection(
+        self, ttl: Optional[float] = None, force: bool = False
+    ) -> bool:
+        """
+        Check S3 connection health
+
+        Reuses the last result for ttl seconds (HEALTH_CHECK_TTL by default);
+        pass force=True for a deep check that always calls S3.
+        """
+        if ttl is None:
+            ttl = settings.HEALTH_CHECK_TTL
+        checked_at, healthy = self._last_check
+        if not force and checked_at and time.monotonic() - checked_at < ttl:
+            return healthy
+
         try:
             self.s3_client.head_bucket(Bucket=self.bucket_name)
-            return True
+            healthy = True
         except ClientError:
-            return False
+            healthy = False
+
+        self._last_check = (time.monotonic(), healthy)
+        return healthy
 
     def delete_file(self, file_key: str) -> bool:
         """Delete a file from S3"""
@@ -143,6 +366,26 @@ class S3Service:
         except ClientError as e:
             raise Exception(f"AWS S3 error: {str(e)}")
 
+    def delete_files(self, file_keys: List[str]) -> List[str]:
+        """Delete files from S3 in batches, returning the keys that failed"""
+        failed = []
+        try:
+            # DeleteObjects accepts up to 1000 keys per request
+            for start in range(0, len(file_keys), 1000):
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        "Objects": [
+                            {"Key": key} for key in file_keys[start : start + 1000]
+                        ],
+                        "Quiet": True,
+                    },
+                )
+                failed.extend(error["Key"] for error in response.get("Errors", ()))
+            return failed
+        except ClientError as e:
+            raise Exception(f"AWS S3 error: {str(e)}")
+
 
 # Create a singleton instance
 s3_service = S3Service()
@@ -1,10 +1,14 @@
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import logging
-import os
+import time
 
-from fastapi import FastAPI, HTTPException, Query, Depends, Request
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from starlette.concurrency import run_in_threadpool
+import orjson
 
 from app.config import settings
 from app.models import (
@@ -14,20 +18,52 @@ from app.models import (
     PresignedUrlResponse,
     UploadRequest,
 )
-from app.s3_service import s3_service
+from app.s3_service import get_file_extension, s3_service
 from app.auth import get_current_user, require_upload, require_download, require_list, require_delete
-from app.rate_limiter import check_rate_limit
+from app.rate_limiter import RequestClockMiddleware, check_rate_limit, redis_rate_limiter
 from app.audit_logger import AuditLogger
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL.upper()),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Create logs directory
-os.makedirs("logs", exist_ok=True)
+_logging_configured = False
+
+
+def _configure_logging():
+    """Configure root logging once per process, at startup rather than import"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL.upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # The log format doesn't use thread/process fields, so skip collecting them
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    _logging_configured = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The audit writer creates the directory for AUDIT_LOG_FILE itself
+    _configure_logging()
+
+    # Blocking S3 calls run in the threadpool; allow as many of them in flight
+    # as the S3 connection pool can serve
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, settings.S3_MAX_POOL_CONNECTIONS)
+
+    # Resolve AWS credentials up front (may query instance metadata or STS)
+    await run_in_threadpool(s3_service.load_credentials)
+
+    if redis_rate_limiter is not None:
+        await redis_rate_limiter.load()
+    yield
+    if redis_rate_limiter is not None:
+        await redis_rate_limiter.close()
+
 
 app = FastAPI(
     title="S3 Presigned URL API",
@@ -35,6 +71,7 @@ app = FastAPI(
     version="2.0.0",
     docs_url="/docs" if not settings.is_production() else None,  # Disable docs in production
     redoc_url="/redoc" if not settings.is_production() else None,
+    lifespan=lifespan,
 )
 
 # Security middleware
@@ -44,42 +81,68 @@ if settings.is_production():
         allowed_hosts=["yourdomain.com", "*.yourdomain.com"]  # Configure for your domain
     )
 
-# CORS middleware for frontend integration
+# Per-request monotonic timestamp (request.state.now) for rate limiting
+app.add_middleware(RequestClockMiddleware)
+
+# CORS middleware for frontend integration. Added last so it is the outermost
+# layer: preflight OPTIONS requests are answered here without reaching the
+# other middleware, auth, rate limiting or auditing.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "DELETE"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
 
+# Static for the life of the process, so build and encode it once
+_ROOT_PAYLOAD = orjson.dumps({
+    "message": "S3 Presigned URL API",
+    "version": "1.0.0",
+    "endpoints": {
+        "upload": "/upload-url",
+        "download": "/download-url",
+        "files": "/files",
+        "health": "/health",
+    },
+    "allowed_file_types": list(settings.ALLOWED_FILE_TYPES.keys()),
+})
+
+
 @app.get("/")
 async def root():
-    return {
-        "message": "S3 Presigned URL API",
-        "version": "1.0.0",
-        "endpoints": {
-            "upload": "/upload-url",
-            "download": "/download-url",
-            "files": "/files",
-            "health": "/health",
-        },
-        "allowed_file_types": list(settings.ALLOWED_FILE_TYPES.keys()),
-    }
+    return Response(content=_ROOT_PAYLOAD, media_type="application/json")
+
+
+# Probes don't need sub-100ms precision, so reuse the formatted timestamp
+_HEALTH_TIMESTAMP_TTL = 0.1
+_health_timestamp = (0.0, "")
+
+
+def _get_health_timestamp() -> str:
+    global _health_timestamp
+    now = time.monotonic()
+    if now - _health_timestamp[0] > _HEALTH_TIMESTAMP_TTL:
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        _health_timestamp = (now, timestamp)
+    return _health_timestamp[1]
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    s3_healthy = s3_service.check_connection()
+    s3_healthy = await run_in_threadpool(s3_service.check_connection)
 
     if not s3_healthy:
         raise HTTPException(status_code=503, detail="S3 connection failed")
 
-    return HealthResponse(
-        status="healthy", s3_connection="ok", timestamp=datetime.now()
-    )
+    return {
+        "status": "healthy",
+        "s3_connection": "ok",
+        "timestamp": _get_health_timestamp(),
+    }
 
 
 @app.post("/upload-url", response_model=PresignedUrlResponse)
@@ -101,21 +164,30 @@ async def generate_upload_url(
     
     try:
         # Enhanced file validation
-        file_extension = os.path.splitext(upload_request.filename.lower())[1]
+        # Lowercase only the extension, not the whole filename
+        file_extension = get_file_extension(upload_request.filename).lower()
         if file_extension in settings.BLOCKED_FILE_TYPES:
             AuditLogger.log_presigned_url_generation(
                 user_id, request, "upload", "", upload_request.filename,
                 success=False, error_message=f"Blocked file type: {file_extension}"
             )
             raise HTTPException(
-                status_code=400, 
+                status_code=400,
                 detail=f"File type {file_extension} is blocked for security reasons"
             )
         
-        result = s3_service.generate_upload_url(
-            filename=upload_request.filename, 
-            content_type=upload_request.content_type
-        )
+        # Presigning is local CPU work unless credentials need a network refresh
+        if s3_service.presign_may_block():
+            result = await run_in_threadpool(
+                s3_service.generate_upload_url,
+                filename=upload_request.filename,
+                content_type=upload_request.content_type
+            )
+        else:
+            result = s3_service.generate_upload_url(
+                filename=upload_request.filename, 
+                content_type=upload_request.content_type
+            )
         
         # Audit log successful URL generation
         AuditLogger.log_presigned_url_generation(
@@ -123,9 +195,13 @@ async def generate_upload_url(
             upload_request.filename, result["expires_in"]
         )
         
-        logger.info(f"Upload URL generated for user {user_id}, file: {upload_request.filename}")
-        return PresignedUrlResponse(**result)
+        logger.info(
+            "Upload URL generated for user %s, file: %s", user_id, upload_request.filename
+        )
+        return result
 
+    except HTTPException:
+        raise
     except ValueError as e:
         AuditLogger.log_presigned_url_generation(
             user_id, request, "upload", "", upload_request.filename,
@@ -137,7 +213,7 @@ async def generate_upload_url(
             user_id, request, "upload", "", upload_request.filename,
             success=False, error_message=str(e)
         )
-        logger.error(f"Upload URL generation failed for user {user_id}: {str(e)}")
+        logger.error("Upload URL generation failed for user %s: %s", user_id, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -149,9 +225,16 @@ async def generate_download_url(request: DownloadRequest):
     The client can use this URL to download files directly from S3.
     """
     try:
-        result = s3_service.generate_download_url(request.file_key)
+        # Presigning is local CPU work; only the optional existence check and
+        # credential refreshes hit the network
+        if settings.STRICT_EXISTS_CHECK or s3_service.presign_may_block():
+            result = await run_in_threadpool(
+                s3_service.generate_download_url, request.file_key
+            )
+        else:
+            result = s3_service.generate_download_url(request.file_key)
 
-        return PresignedUrlResponse(**result)
+        return result
 
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -168,8 +251,10 @@ async def list_files(
     List files in the S3 bucket (optional endpoint for file management)
     """
     try:
-        result = s3_service.list_files(prefix=prefix, max_keys=max_keys)
-        return FileListResponse(**result)
+        result = await run_in_threadpool(
+            s3_service.list_files, prefix=prefix, max_keys=max_keys
+        )
+        return result
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -181,7 +266,7 @@ async def delete_file(file_key: str):
     Delete a file from S3 bucket
     """
     try:
-        success = s3_service.delete_file(file_key)
+        success = await run_in_threadpool(s3_service.delete_file, file_key)
         if success:
             return {"message": f"File {file_key} deleted successfully"}
         else:
@@ -192,6 +277,19 @@ async def delete_file(file_key: str):
 
 
 if __name__ == "__main__":
+    import os
+
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # In-process rate limits and caches are per worker, so only fan out to
+    # every CPU when limits are shared through Redis
+    default_workers = (os.cpu_count() or 1) if settings.REDIS_URL else 1
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", default_workers)),
+    )
@@ -6,12 +6,16 @@ setup(
     description="FastAPI application for S3 presigned URL generation",
     packages=find_packages(),
     install_requires=[
-        "fastapi==0.104.1",
-        "uvicorn==0.24.0",
+        "fastapi>=0.130.0",
+        "uvicorn[standard]>=0.32.0",
         "boto3==1.34.0",
         "python-dotenv==1.0.0",
-        "pydantic==2.5.0",
-        "python-multipart==0.0.6"
+        "pydantic>=2.10.0",
+        "python-multipart==0.0.6",
+        "orjson>=3.9.0",
     ],
+    # Local SigV4 presigning uses hashlib/hmac, which should be backed by
+    # OpenSSL >= 1.1.1 (check ssl.OPENSSL_VERSION) to get SHA-NI / ARMv8 SHA2
+    # accelerated SHA-256; the official python images satisfy this
     python_requires=">=3.8",
 )
\ No newline at end of file
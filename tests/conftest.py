@@ -0,0 +1,11 @@
+from unittest.mock import patch
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def audit_log_file(tmp_path_factory):
+    """Write audit entries from the test run to a temporary file"""
+    path = tmp_path_factory.mktemp("logs") / "audit.log"
+    with patch("app.audit_logger.AUDIT_LOG_FILE", str(path)):
+        yield path
@@ -2,6 +2,7 @@ from unittest.mock import patch
 
 from fastapi.testclient import TestClient
 
+from app.auth import AuthService
 from main import app
 
 client = TestClient(app)
@@ -18,6 +19,18 @@ class TestAPI:
         assert "endpoints" in data
         assert "allowed_file_types" in data
 
+    def test_cors_preflight(self):
+        """Test CORS preflight is answered without authentication"""
+        response = client.options(
+            "/upload-url",
+            headers={
+                "Origin": "http://localhost:3000",
+                "Access-Control-Request-Method": "POST",
+            },
+        )
+        assert response.status_code == 200
+        assert response.headers["access-control-max-age"] == "86400"
+
     @patch("app.s3_service.s3_service.check_connection")
     def test_health_check_success(self, mock_check):
         """Test health check when S3 is healthy"""
@@ -66,6 +79,38 @@ class TestAPI:
 
         assert response.status_code == 400
 
+    @patch("app.s3_service.s3_service.generate_upload_url")
+    def test_upload_url_blocked_file_type(self, mock_generate):
+        """Test blocked file types are rejected with 400 before presigning"""
+        token = AuthService.create_access_token("blocked-user", ["upload"])
+
+        response = client.post(
+            "/upload-url",
+            json={"filename": "payload.EXE"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == (
+            "File type .exe is blocked for security reasons"
+        )
+        mock_generate.assert_not_called()
+
+    @patch("app.s3_service.s3_service.generate_upload_url")
+    def test_upload_url_internal_error(self, mock_generate):
+        """Test unexpected upload errors return a generic 500"""
+        mock_generate.side_effect = RuntimeError("boom")
+        token = AuthService.create_access_token("error-user", ["upload"])
+
+        response = client.post(
+            "/upload-url",
+            json={"filename": "test.pdf"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status_code == 500
+        assert response.json()["detail"] == "Internal server error"
+
     @patch("app.s3_service.s3_service.generate_download_url")
     def test_download_url_success(self, mock_generate):
         """Test successful download URL generation"""
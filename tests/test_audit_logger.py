@@ -0,0 +1,167 @@
+import errno
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import orjson
+import pytest
+
+from app import audit_logger
+from app.audit_logger import (
+    _STOP,
+    AuditBatchWriter,
+    AuditQueueHandler,
+    _encode_json,
+    _encode_line,
+    _encode_msgpack,
+)
+
+
+def make_entry(**details):
+    return {
+        "timestamp": datetime(2024, 1, 1, 12, 0, 0, 500, tzinfo=timezone.utc),
+        "event_type": "presigned_url_generated",
+        "user_id": "user-1",
+        "success": True,
+        "details": details,
+    }
+
+
+class FlakyStream:
+    """Stream whose first write fails with ENOSPC"""
+
+    def __init__(self):
+        self.calls = 0
+        self.written = []
+
+    def write(self, data):
+        self.calls += 1
+        if self.calls == 1:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        self.written.append(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestAuditBatchWriter:
+
+    def test_write_error_keeps_writer_running(self, tmp_path):
+        """Test a failed write drops its batch but the writer keeps going"""
+        writer = AuditBatchWriter(
+            str(tmp_path / "audit.log"), batch_size=1, batch_ms=0, flush_ms=0
+        )
+        writer.stream.close()
+        writer.stream = FlakyStream()
+        writer.start()
+
+        writer.queue.put(b"first\n")
+        deadline = time.monotonic() + 5
+        while writer.stream.calls < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.queue.put(b"second\n")
+
+        stream = writer.stream
+        assert writer.is_alive()
+        writer.close()
+        assert stream.written == [b"second\n"]
+        assert writer.dropped == 1
+
+
+class TestAuditEncoders:
+
+    def test_encode_json(self):
+        """Test JSON entries are one line with a UTC Z timestamp"""
+        line = _encode_json(make_entry(filename="x.pdf\nevent_type=forged"))
+
+        assert line.endswith(b"\n") and line.count(b"\n") == 1
+        decoded = orjson.loads(line)
+        assert decoded["timestamp"] == "2024-01-01T12:00:00.000500Z"
+        assert decoded["details"]["filename"] == "x.pdf\nevent_type=forged"
+
+    def test_encode_line(self):
+        """Test logfmt entries quote values that could break the line"""
+        line = _encode_line(
+            make_entry(
+                operation="upload",
+                filename="x.pdf\nevent_type=forged",
+                note="a\u2028b",
+                user_agent="curl 8.0",
+            )
+        )
+
+        assert line.endswith(b"\n") and line.count(b"\n") == 1
+        text = line.decode()
+        assert text.startswith("timestamp=2024-01-01T12:00:00.000500Z ")
+        assert " operation=upload " in text
+        assert ' filename="x.pdf\\nevent_type=forged" ' in text
+        assert ' note="a\\u2028b" ' in text
+        assert text.endswith(' user_agent="curl 8.0"\n')
+
+    def test_encode_msgpack(self):
+        """Test MessagePack entries round-trip"""
+        msgpack = pytest.importorskip("msgpack")
+        entry = make_entry(filename="x.pdf\nevent_type=forged")
+
+        decoded = msgpack.unpackb(_encode_msgpack(entry), timestamp=3)
+        assert decoded == entry
+
+
+class TestAuditQueueHandler:
+
+    def make_handler(self, tmp_path, size=2):
+        writer = AuditBatchWriter(
+            str(tmp_path / "audit.log"), batch_size=1, batch_ms=0, flush_ms=0
+        )
+        writer.queue = queue.Queue(maxsize=size)
+        return AuditQueueHandler(writer)
+
+    def test_overflow_evicts_oldest_entry(self, tmp_path):
+        """Test a full queue drops its oldest entry and keeps the newest"""
+        handler = self.make_handler(tmp_path)
+
+        for entry in (b"1\n", b"2\n", b"3\n", b"4\n"):
+            handler.enqueue(entry)
+
+        assert list(handler.queue.queue) == [b"3\n", b"4\n"]
+        assert handler.writer.dropped == 2
+        handler.writer.close()
+
+    def test_overflow_keeps_stop_sentinel(self, tmp_path):
+        """Test overflow during shutdown never evicts the stop sentinel"""
+        handler = self.make_handler(tmp_path)
+        handler.queue.put(_STOP)
+        handler.queue.put(b"1\n")
+
+        handler.enqueue(b"2\n")
+
+        assert _STOP in handler.queue.queue
+        assert b"2\n" not in handler.queue.queue
+        assert handler.writer.dropped == 1
+        handler.writer.close()
+
+
+class TestEnsureHandler:
+
+    def test_unwritable_log_file_falls_back_to_stderr(self, tmp_path):
+        """Test an unwritable AUDIT_LOG_FILE degrades to stderr instead of failing"""
+        blocker = tmp_path / "not-a-directory"
+        blocker.write_text("")
+
+        with patch.object(audit_logger, "_HANDLER", None), patch.object(
+            audit_logger, "AUDIT_LOG_FILE", str(blocker / "audit.log")
+        ):
+            handler = audit_logger._ensure_handler()
+            assert audit_logger._ensure_handler() is handler
+
+        try:
+            assert handler.writer.is_alive()
+            assert handler.writer.stream.fileno() == sys.stderr.fileno()
+        finally:
+            audit_logger.audit_logger.removeHandler(handler)
+            handler.writer.close()
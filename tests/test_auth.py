@@ -0,0 +1,91 @@
+import time
+from unittest.mock import patch
+
+import jwt
+import pytest
+
+from app import auth
+from app.auth import AuthService
+
+
+def make_token(user_id, exp):
+    payload = {"user_id": user_id, "permissions": ["upload"], "exp": exp}
+    return jwt.encode(payload, auth.JWT_SECRET_KEY, algorithm=auth.JWT_ALGORITHM)
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    auth._token_cache.clear()
+    yield
+    auth._token_cache.clear()
+
+
+class TestVerifyTokenCache:
+
+    def test_cache_hit_skips_decode(self):
+        """Test a repeated token is served from the cache"""
+        token = make_token("user-1", int(time.time()) + 3600)
+
+        with patch.object(
+            auth._jwt_decoder, "decode", wraps=auth._jwt_decoder.decode
+        ) as decode:
+            first = AuthService.verify_token(token)
+            second = AuthService.verify_token(token)
+
+        assert decode.call_count == 1
+        assert first == second
+        assert first["user_id"] == "user-1"
+
+    def test_cache_entry_expires_after_ttl(self):
+        """Test cached verifications are redone after JWT_CACHE_TTL"""
+        now = time.time()
+        token = make_token("user-1", int(now) + 3600)
+
+        with patch.object(
+            auth._jwt_decoder, "decode", wraps=auth._jwt_decoder.decode
+        ) as decode:
+            with patch("app.auth.time.time", return_value=now):
+                AuthService.verify_token(token)
+            with patch("app.auth.time.time", return_value=now + auth.JWT_CACHE_TTL + 1):
+                AuthService.verify_token(token)
+
+        assert decode.call_count == 2
+
+    def test_cache_entry_capped_at_token_expiry(self):
+        """Test a token is never served from the cache past its exp"""
+        exp = int(time.time()) + 5
+        token = make_token("user-1", exp)
+
+        AuthService.verify_token(token)
+        (expires_at, _), = auth._token_cache.values()
+        assert expires_at == exp
+
+        with patch.object(
+            auth._jwt_decoder, "decode", wraps=auth._jwt_decoder.decode
+        ) as decode:
+            with patch("app.auth.time.time", return_value=exp):
+                AuthService.verify_token(token)
+        decode.assert_called_once()
+
+    def test_least_recently_used_entry_evicted(self):
+        """Test the cache evicts the least recently used token when full"""
+        exp = int(time.time()) + 3600
+        tokens = [make_token(f"user-{i}", exp) for i in range(3)]
+
+        with patch("app.auth.JWT_CACHE_SIZE", 2):
+            AuthService.verify_token(tokens[0])
+            AuthService.verify_token(tokens[1])
+            AuthService.verify_token(tokens[0])  # Now most recently used
+            AuthService.verify_token(tokens[2])
+
+        cached_users = [payload["user_id"] for _, payload in auth._token_cache.values()]
+        assert cached_users == ["user-0", "user-2"]
+
+    def test_returned_payload_is_a_copy(self):
+        """Test modifying a returned payload doesn't change the cached one"""
+        token = make_token("user-1", int(time.time()) + 3600)
+
+        AuthService.verify_token(token)["user_id"] = "mallory"
+        AuthService.verify_token(token)["user_id"] = "mallory"
+
+        assert AuthService.verify_token(token)["user_id"] == "user-1"
@@ -0,0 +1,113 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.rate_limiter import RateLimiter, RedisRateLimiter
+
+
+class TestRateLimiter:
+
+    def test_burst_within_window(self):
+        """Test the limit applies within one window and Retry-After is honest"""
+        limiter = RateLimiter()
+        now = 600.0
+
+        for _ in range(10):
+            assert limiter.is_allowed("user-1", "upload", now) == (True, None)
+        allowed, retry_after = limiter.is_allowed("user-1", "upload", now)
+        assert allowed is False
+
+        assert limiter.is_allowed("user-2", "upload", now) == (True, None)
+        assert limiter.is_allowed("user-1", "upload", now + retry_after)[0] is True
+
+    def test_previous_window_carries_over(self):
+        """Test the previous window's count is weighted by its overlap"""
+        limiter = RateLimiter()
+        for _ in range(10):
+            assert limiter.is_allowed("user-1", "upload", 650.0)[0] is True
+
+        # 50 of the previous window's 60 seconds still overlap: 10 * 50/60
+        now = 670.0
+        assert limiter.is_allowed("user-1", "upload", now)[0] is True
+        assert limiter.is_allowed("user-1", "upload", now)[0] is True
+        allowed, retry_after = limiter.is_allowed("user-1", "upload", now)
+        assert allowed is False
+
+        assert limiter.is_allowed("user-1", "upload", now + retry_after)[0] is True
+
+    def test_stale_entries_swept_once_per_window(self):
+        """Test a full table is swept at most once per window"""
+        limiter = RateLimiter()
+        limiter.max_entries = 2
+        limiter.is_allowed("old", "upload", 0.0)
+        limiter.is_allowed("user-1", "upload", 600.0)
+
+        with patch.object(
+            limiter, "_sweep_stale_entries", wraps=limiter._sweep_stale_entries
+        ) as sweep:
+            limiter.is_allowed("user-2", "upload", 600.0)
+            limiter.is_allowed("user-3", "upload", 600.0)
+            limiter.is_allowed("user-4", "upload", 600.0)
+
+        assert sweep.call_count == 1
+        assert ("old", "upload") not in limiter.counters
+        assert len(limiter.counters) == 4
+
+
+class TestRedisRateLimiter:
+
+    def make_limiter(self):
+        limiter = RedisRateLimiter("redis://localhost:6379/0", RateLimiter())
+        limiter.script = AsyncMock()
+        return limiter
+
+    def test_client_timeouts(self):
+        """Test Redis connections fail fast instead of waiting on the OS"""
+        limiter = self.make_limiter()
+        kwargs = limiter.redis.connection_pool.connection_kwargs
+
+        assert 0 < kwargs["socket_connect_timeout"] < 1
+        assert 0 < kwargs["socket_timeout"] < 1
+
+    def test_redis_error_backs_off_to_local_limiter(self):
+        """Test a Redis error switches to the local limiter for a while"""
+        limiter = self.make_limiter()
+        limiter.script.side_effect = RedisConnectionError("unreachable")
+
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (True, None)
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (True, None)
+        assert limiter.script.await_count == 1
+        assert limiter.fallback.counters[("user-1", "upload")][1] == 2
+
+        with patch("app.rate_limiter.time.monotonic", return_value=limiter.retry_at):
+            limiter.script.side_effect = None
+            limiter.script.return_value = 0
+            assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (True, None)
+        assert limiter.script.await_count == 2
+
+    def test_allowed_runs_script_once(self):
+        """Test an admitted request is one script call with the window arguments"""
+        limiter = self.make_limiter()
+        limiter.script.return_value = 0
+
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (True, None)
+
+        kwargs = limiter.script.await_args.kwargs
+        assert kwargs["keys"] == ["rl:user-1:upload"]
+        now_ms, window_ms, limit, member = kwargs["args"]
+        assert window_ms == 60_000
+        assert limit == limiter.fallback.rate_limits["upload"]
+        assert member.startswith(f"{now_ms}-")
+
+    def test_rejected_returns_retry_after(self):
+        """Test a rejection converts the script's wait to whole seconds"""
+        limiter = self.make_limiter()
+
+        limiter.script.return_value = 1500
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (False, 2)
+        limiter.script.return_value = 1
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (False, 1)
+        limiter.script.return_value = 1000
+        assert asyncio.run(limiter.is_allowed("user-1", "upload")) == (False, 1)
+        assert limiter.fallback.counters == {}
@@ -1,24 +1,36 @@
-from unittest.mock import Mock, patch
+from datetime import datetime, timezone
+from unittest.mock import patch
+from urllib.parse import parse_qsl, urlsplit
 
+import boto3
 import pytest
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.credentials import Credentials, RefreshableCredentials
+from botocore.exceptions import ClientError, NoCredentialsError
 
 from app.config import settings
-from app.s3_service import S3Service
+from app.s3_service import _S3, S3Service, _SigV4Presigner
+
+
+@pytest.fixture
+def static_credentials():
+    """Resolve static credentials, so URLs are signed locally"""
+    with patch(
+        "app.s3_service._SESSION.get_credentials",
+        return_value=Credentials("AKIDEXAMPLE", "secret"),
+    ) as get_credentials:
+        yield get_credentials
 
 
 class TestS3Service:
 
-    @patch("boto3.client")
-    def test_init(self, mock_boto_client):
-        """Test S3Service initialization"""
-        S3Service()
-        mock_boto_client.assert_called_once_with(
-            "s3",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_REGION,
-        )
+    def test_init(self):
+        """Test S3Service initialization reuses the shared client"""
+        service = S3Service()
+        assert service.s3_client is _S3
+        assert S3Service().s3_client is service.s3_client
+        assert _S3.meta.region_name == settings.AWS_REGION
+        assert _S3.meta.config.max_pool_connections == settings.S3_MAX_POOL_CONNECTIONS
 
     def test_validate_file_type_valid(self):
         """Test file type validation with valid file"""
@@ -34,6 +46,15 @@ class TestS3Service:
         assert is_valid is False
         assert "not allowed" in error_msg
 
+    def test_validate_file_type_extension_parsing(self):
+        """Test extension parsing is case-insensitive and ignores dotfiles"""
+        service = S3Service()
+        assert service.validate_file_type("REPORT.PDF") == (True, "application/pdf")
+        assert service.validate_file_type("archive.tar.zip")[0] is True
+        assert service.validate_file_type("README")[0] is False
+        assert service.validate_file_type(".pdf")[0] is False
+        assert service.validate_file_type("docs.pdf/notes")[0] is False
+
     def test_generate_unique_key(self):
         """Test unique key generation"""
         service = S3Service()
@@ -43,15 +64,14 @@ class TestS3Service:
         assert key1 != key2  # Should be unique
         assert key1.startswith("uploads/")
         assert key1.endswith(".pdf")
+        # Timestamp-prefixed IDs sort by creation time
+        assert key1[8:20] <= key2[8:20]
+        assert len(key1) == len("uploads/") + 32 + len(".pdf")
 
-    @patch("boto3.client")
-    def test_generate_upload_url_success(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_generate_upload_url_success(self, mock_s3, static_credentials):
         """Test successful upload URL generation"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
-        mock_s3.generate_presigned_url.return_value = (
-            "https://s3.amazonaws.com/test-url"
-        )
+        mock_s3.meta.endpoint_url = "https://s3.us-east-1.amazonaws.com"
 
         service = S3Service()
         result = service.generate_upload_url("test.pdf")
@@ -60,36 +80,32 @@ class TestS3Service:
         assert "file_key" in result
         assert "expires_in" in result
         assert result["expires_in"] == settings.PRESIGNED_URL_EXPIRATION
+        assert "X-Amz-Signature=" in result["presigned_url"]
 
-    @patch("boto3.client")
-    def test_generate_upload_url_invalid_file(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_generate_upload_url_invalid_file(self, mock_s3):
         """Test upload URL generation with invalid file type"""
         service = S3Service()
 
         with pytest.raises(ValueError):
             service.generate_upload_url("malware.exe")
 
-    @patch("boto3.client")
-    def test_generate_download_url_success(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_generate_download_url_success(self, mock_s3, static_credentials):
         """Test successful download URL generation"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
         mock_s3.head_object.return_value = {}  # File exists
-        mock_s3.generate_presigned_url.return_value = (
-            "https://s3.amazonaws.com/download-url"
-        )
+        mock_s3.meta.endpoint_url = "https://s3.us-east-1.amazonaws.com"
 
         service = S3Service()
         result = service.generate_download_url("uploads/test.pdf")
 
         assert "presigned_url" in result
         assert result["file_key"] == "uploads/test.pdf"
+        mock_s3.head_object.assert_not_called()
 
-    @patch("boto3.client")
-    def test_generate_download_url_file_not_found(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_generate_download_url_file_not_found(self, mock_s3):
         """Test download URL generation for non-existent file"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
 
         # Simulate file not found
         error_response = {"Error": {"Code": "404"}}
@@ -97,14 +113,13 @@ class TestS3Service:
 
         service = S3Service()
 
-        with pytest.raises(FileNotFoundError):
-            service.generate_download_url("uploads/nonexistent.pdf")
+        with patch.object(settings, "STRICT_EXISTS_CHECK", True):
+            with pytest.raises(FileNotFoundError):
+                service.generate_download_url("uploads/nonexistent.pdf")
 
-    @patch("boto3.client")
-    def test_list_files_success(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_list_files_success(self, mock_s3):
         """Test successful file listing"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
 
         mock_response = {
             "Contents": [
@@ -125,11 +140,9 @@ class TestS3Service:
         assert len(result["files"]) == 1
         assert result["files"][0]["key"] == "uploads/test.pdf"
 
-    @patch("boto3.client")
-    def test_list_files_empty(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_list_files_empty(self, mock_s3):
         """Test file listing with no files"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
         mock_s3.list_objects_v2.return_value = {}  # No Contents key
 
         service = S3Service()
@@ -138,11 +151,9 @@ class TestS3Service:
         assert result["count"] == 0
         assert result["files"] == []
 
-    @patch("boto3.client")
-    def test_check_connection_success(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_check_connection_success(self, mock_s3):
         """Test successful connection check"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
         mock_s3.head_bucket.return_value = {}
 
         service = S3Service()
@@ -150,11 +161,9 @@ class TestS3Service:
 
         assert result is True
 
-    @patch("boto3.client")
-    def test_check_connection_failure(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_check_connection_failure(self, mock_s3):
         """Test connection check failure"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
         mock_s3.head_bucket.side_effect = ClientError({}, "head_bucket")
 
         service = S3Service()
@@ -162,11 +171,23 @@ class TestS3Service:
 
         assert result is False
 
-    @patch("boto3.client")
-    def test_delete_file_success(self, mock_boto_client):
+    @patch("app.s3_service._S3")
+    def test_check_connection_cached(self, mock_s3):
+        """Test connection check results are reused within the TTL"""
+        mock_s3.head_bucket.return_value = {}
+
+        service = S3Service()
+        assert service.check_connection(ttl=60) is True
+        assert service.check_connection(ttl=60) is True
+        assert mock_s3.head_bucket.call_count == 1
+
+        assert service.check_connection(ttl=60, force=True) is True
+        assert service.check_connection(ttl=0) is True
+        assert mock_s3.head_bucket.call_count == 3
+
+    @patch("app.s3_service._S3")
+    def test_delete_file_success(self, mock_s3):
         """Test successful file deletion"""
-        mock_s3 = Mock()
-        mock_boto_client.return_value = mock_s3
         mock_s3.delete_object.return_value = {}
 
         service = S3Service()
@@ -176,3 +197,133 @@ class TestS3Service:
         mock_s3.delete_object.assert_called_once_with(
             Bucket=settings.S3_BUCKET_NAME, Key="uploads/test.pdf"
         )
+
+    @patch("app.s3_service._S3")
+    def test_delete_files_batches(self, mock_s3):
+        """Test bulk deletion is chunked into DeleteObjects calls of 1000 keys"""
+        mock_s3.delete_objects.side_effect = [
+            {},
+            {"Errors": [{"Key": "uploads/1000.pdf", "Code": "AccessDenied"}]},
+        ]
+
+        service = S3Service()
+        keys = [f"uploads/{i}.pdf" for i in range(1500)]
+        failed = service.delete_files(keys)
+
+        assert failed == ["uploads/1000.pdf"]
+        assert mock_s3.delete_objects.call_count == 2
+        batches = [
+            call.kwargs["Delete"]["Objects"]
+            for call in mock_s3.delete_objects.call_args_list
+        ]
+        assert [len(batch) for batch in batches] == [1000, 500]
+        assert batches[1][0] == {"Key": "uploads/1000.pdf"}
+
+    @pytest.mark.parametrize(
+        "bucket,addressing_style,token,content_type,region,endpoint_url",
+        [
+            ("my-bucket", "virtual", None, "application/pdf", "eu-west-1", None),
+            ("my.bucket", "path", None, "application/pdf", "eu-west-1", None),
+            ("my-bucket", "virtual", "session/token+==", "application/pdf", "eu-west-1", None),
+            ("my-bucket", "virtual", None, " text/plain;  charset=utf-8 ", "eu-west-1", None),
+            ("my-bucket", "virtual", None, "application/pdf", "us-east-1", None),
+            ("my-bucket", "virtual", None, "application/pdf", "cn-north-1", None),
+            ("my-bucket", "virtual", None, "application/pdf", "eu-west-1", "http://localhost:4566"),
+            ("my.bucket", "path", None, "application/pdf", "eu-west-1", "http://localhost:4566"),
+        ],
+    )
+    def test_sigv4_presigner_matches_botocore(
+        self, bucket, addressing_style, token, content_type, region, endpoint_url
+    ):
+        """Test local presigned URLs are identical to botocore's SigV4 output"""
+        now = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        client = boto3.client(
+            "s3",
+            aws_access_key_id="AKIDEXAMPLE",
+            aws_secret_access_key="secret",
+            aws_session_token=token,
+            region_name=region,
+            endpoint_url=endpoint_url,
+            config=Config(
+                signature_version="s3v4", s3={"addressing_style": addressing_style}
+            ),
+        )
+        presigner = _SigV4Presigner(
+            Credentials("AKIDEXAMPLE", "secret", token),
+            region,
+            bucket,
+            client.meta.endpoint_url,
+        )
+        key = "uploads/a b+c~.pdf"
+
+        with patch(
+            "botocore.auth.get_current_datetime",
+            return_value=now.replace(tzinfo=None),
+        ):
+            expected_put = client.generate_presigned_url(
+                "put_object",
+                Params={"Bucket": bucket, "Key": key, "ContentType": content_type},
+                ExpiresIn=600,
+            )
+            expected_get = client.generate_presigned_url(
+                "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=600
+            )
+
+        def parts(url):
+            split = urlsplit(url)
+            return split.scheme, split.netloc, split.path, sorted(parse_qsl(split.query))
+
+        put_url = presigner.presign("PUT", key, 600, content_type, now)
+        assert parts(put_url) == parts(expected_put)
+        assert parts(presigner.presign("GET", key, 600, now=now)) == parts(expected_get)
+
+    @patch("app.s3_service._S3")
+    def test_missing_credentials_resolved_once(self, mock_s3):
+        """Test a credentials miss is cached and fails every presign clearly"""
+        with patch(
+            "app.s3_service._SESSION.get_credentials", return_value=None
+        ) as get_credentials:
+            service = S3Service()
+            for _ in range(3):
+                with pytest.raises(NoCredentialsError):
+                    service.generate_upload_url("test.pdf")
+
+        get_credentials.assert_called_once()
+        mock_s3.generate_presigned_url.assert_not_called()
+        assert service.presign_may_block() is False
+
+    @patch("app.s3_service._S3")
+    def test_presign_may_block_when_refresh_needed(self, mock_s3):
+        """Test presigning is flagged as blocking while credentials need a refresh"""
+        mock_s3.meta.endpoint_url = "https://s3.us-east-1.amazonaws.com"
+        credentials = RefreshableCredentials.create_from_metadata(
+            {
+                "access_key": "AKIDEXAMPLE",
+                "secret_key": "secret",
+                "token": "token",
+                "expiry_time": "2000-01-01T00:00:00Z",
+            },
+            refresh_using=lambda: {},
+            method="test",
+        )
+        with patch(
+            "app.s3_service._SESSION.get_credentials", return_value=credentials
+        ):
+            service = S3Service()
+            assert service.presign_may_block() is True  # Not resolved yet
+            service.load_credentials()
+
+        assert service.presign_may_block() is True  # Expired
+        with patch.object(credentials, "refresh_needed", return_value=False):
+            assert service.presign_may_block() is False
+
+    @patch("app.s3_service._S3")
+    def test_generate_upload_url_signs_locally(self, mock_s3, static_credentials):
+        """Test upload URLs are signed locally once credentials resolve"""
+        mock_s3.meta.endpoint_url = "https://s3.us-east-1.amazonaws.com"
+        service = S3Service()
+        result = service.generate_upload_url("test.pdf")
+
+        mock_s3.generate_presigned_url.assert_not_called()
+        assert "X-Amz-Signature=" in result["presigned_url"]
+        assert result["file_key"] in result["presigned_url"]